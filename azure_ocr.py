@@ -1,84 +1,338 @@
 from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as DocumentIntelligenceClientAsync
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import AzureError, HttpResponseError, ServiceRequestError, ServiceResponseError
+from contextlib import AsyncExitStack
+import asyncio
+import hashlib
+import itertools
 import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Status codes worth retrying: throttling and transient server-side failures
+_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# Azure receipt field name -> key in our receipt dict ("Items" is handled separately)
+_FIELD_MAP = {
+    "MerchantName": "merchant",
+    "TransactionDate": "date",
+    "Subtotal": "subtotal",
+    "TotalTax": "tax",
+    "Total": "total"
+}
+
+
+def _dump_json(data, path, indent=False):
+    """Write data as JSON, using orjson's C encoder when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=option, default=str))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2 if indent else None, default=str)
+
+
+def _load_json(path):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read()) if orjson is not None else json.load(f)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _is_retryable(error):
+    """Classify an Azure error as transient (retry) or permanent (give up)"""
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        # Network blips: connection reset, timeout, DNS hiccup
+        return True
+    if isinstance(error, HttpResponseError):
+        if error.status_code in _RETRYABLE_STATUS:
+            return True
+        message = str(error).lower()
+        return "rate limit" in message or "quota" in message
+    return False
+
+
+def _extract_receipt_data(result):
+    """
+    Pull the fields we care about out of an AnalyzeResult.
+    Returns a dict with: merchant, date, items, subtotal, tax, total
+    """
+    receipt_data = {
+        "merchant": None,
+        "date": None,
+        "items": [],
+        "subtotal": None,
+        "tax": None,
+        "total": None
+    }
+    
+    # Get document fields
+    if result.documents:
+        for field_name, field in result.documents[0].fields.items():
+            if field_name == "Items":
+                # Use value_array to get the items
+                for item in field.value_array or []:
+                    # item should be a DocumentField with properties
+                    value_object = getattr(item, 'value_object', None) or {}
+                    receipt_data["items"].append({
+                        key: (val.content if hasattr(val, 'content') else str(val))
+                        for key, val in value_object.items()
+                    })
+            elif (key := _FIELD_MAP.get(field_name)) and field.content:
+                receipt_data[key] = field.content
+    
+    return receipt_data
+
 
 class AzureReceiptParser:
-    def __init__(self, api_key, endpoint):
-        self.api_key = api_key
-        self.endpoint = endpoint
-        self.client = DocumentIntelligenceClient(
-            endpoint=endpoint, 
-            credential=AzureKeyCredential(api_key)
-        )
+    def __init__(self, api_key=None, endpoint=None, max_attempts=3, base_delay=1.0, max_delay=30.0,
+                 max_rps=15, cache_dir="cache", credentials=None):
+        """
+        Pass either a single api_key/endpoint or credentials, a list of
+        (endpoint, api_key) pairs for several Azure resources. Requests are
+        round-robined across resources and max_rps applies to each one.
+        """
+        if not credentials:
+            if not api_key or not endpoint:
+                raise ValueError("Either api_key and endpoint or credentials is required")
+            credentials = [(endpoint, api_key)]
+        self.credentials = list(credentials)
+        self.endpoint, self.api_key = self.credentials[0]
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_rps = max_rps
+        self.cache_dir = cache_dir
+        
+        # Minimum spacing between dispatches to stay under each resource's TPS quota
+        self._min_interval = 1.0 / max_rps
+        self._last_dispatch = [0.0] * len(self.credentials)
+        self._locks = [threading.Lock() for _ in self.credentials]
+        
+        # retry_total=0 turns off azure-core's built-in retry policy: _call_with_retry
+        # is the only retry loop, and every attempt goes through the rate limiter
+        self._clients = [
+            DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key), retry_total=0)
+            for endpoint, key in self.credentials
+        ]
+        self.client = self._clients[0]
+        self._rr = itertools.cycle(range(len(self._clients)))
     
     def process_receipt(self, image_path):
         """
         Process a receipt image and extract structured data.
         Returns a dict with: merchant, date, items, subtotal, tax, total
         """
-        with open(image_path, "rb") as f:
-            poller = self.client.begin_analyze_document(
+        # Read once up front so retries resend the same buffer instead of
+        # reopening the file or depending on the SDK rewinding a stream
+        data = _read_bytes(image_path)
+        
+        cache_path = self._cache_path(data)
+        cached = self._load_cached(cache_path)
+        if cached is not None:
+            return cached
+        
+        def analyze():
+            # Each attempt goes to the next resource, so a retry after a 429
+            # usually lands on a different quota
+            index = next(self._rr)
+            self._throttle(index)
+            poller = self._clients[index].begin_analyze_document(
                 model_id="prebuilt-receipt",
-                body=f
+                body=data
             )
+            return poller.result()
         
-        result = poller.result()
+        result = self._call_with_retry(analyze)
+        receipt_data = _extract_receipt_data(result)
+        self._store_cached(cache_path, receipt_data)
+        return receipt_data
+    
+    def _cache_path(self, data):
+        """Cache file for an image, keyed by the SHA-256 of its bytes (None if caching is off)"""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(data).hexdigest()}.json")
+    
+    def _load_cached(self, cache_path):
+        """Return the previously parsed receipt at cache_path, or None"""
+        if not cache_path or not os.path.exists(cache_path):
+            return None
+        try:
+            return _load_json(cache_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring unreadable cache file {cache_path}: {e}")
+            return None
+    
+    def _store_cached(self, cache_path, receipt_data):
+        """
+        Write-through the parsed receipt so re-runs skip Azure.
+        Failures only warn: the OCR result has already been paid for.
+        """
+        if not cache_path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a unique temp file then rename, so concurrent writers of
+            # identical images don't collide and readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                _dump_json(receipt_data, tmp_path)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠ Could not write cache file {cache_path}: {e}")
+    
+    def _throttle(self, index):
+        """Block until at least _min_interval has passed since resource index was last used"""
+        with self._locks[index]:
+            delta = time.monotonic() - self._last_dispatch[index]
+            if delta < self._min_interval:
+                time.sleep(self._min_interval - delta)
+            self._last_dispatch[index] = time.monotonic()
+    
+    async def _throttle_async(self, index, lock):
+        """Async counterpart of _throttle; lock is an asyncio.Lock owned by the batch"""
+        async with lock:
+            delta = time.monotonic() - self._last_dispatch[index]
+            if delta < self._min_interval:
+                await asyncio.sleep(self._min_interval - delta)
+            self._last_dispatch[index] = time.monotonic()
+    
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before the next attempt, honoring Retry-After when sent"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return max(0.0, min(self.max_delay, float(retry_after)))
+                except ValueError:
+                    pass
         
-        # Extract key info
-        receipt_data = {
-            "merchant": None,
-            "date": None,
-            "items": [],
-            "subtotal": None,
-            "tax": None,
-            "total": None
-        }
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay + random.uniform(0, self.base_delay)
+    
+    def _call_with_retry(self, fn, *args, **kwargs):
+        """Call fn, retrying transient Azure errors with exponential backoff"""
+        for attempt in range(self.max_attempts):
+            try:
+                return fn(*args, **kwargs)
+            except AzureError as e:
+                if attempt == self.max_attempts - 1 or not _is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"⚠ Azure request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    async def _call_with_retry_async(self, fn, *args, **kwargs):
+        """Async counterpart of _call_with_retry; fn must be a coroutine function"""
+        for attempt in range(self.max_attempts):
+            try:
+                return await fn(*args, **kwargs)
+            except AzureError as e:
+                if attempt == self.max_attempts - 1 or not _is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"⚠ Azure request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    def process_receipts_batch(self, image_paths, max_concurrency=8):
+        """Process multiple receipts and return list of results"""
+        return asyncio.run(
+            self.process_receipts_batch_async(image_paths, max_concurrency=max_concurrency)
+        )
+    
+    async def _open_async_clients(self, stack):
+        """
+        Open one async client per resource on stack and return a round-robin
+        iterator of (index, client, lock) slots for a batch.
+        The async client's HTTP session is tied to the running event loop,
+        so clients are opened per batch rather than once in __init__
+        """
+        slots = []
+        for index, (endpoint, key) in enumerate(self.credentials):
+            client = await stack.enter_async_context(
+                DocumentIntelligenceClientAsync(
+                    endpoint=endpoint, credential=AzureKeyCredential(key), retry_total=0
+                )
+            )
+            slots.append((index, client, asyncio.Lock()))
+        return itertools.cycle(slots)
+    
+    async def _process_receipt_async(self, rr, sem, path):
+        """
+        Async counterpart of process_receipt for use inside a batch.
+        Never raises: failures come back as {"file": path, "error": ...}
+        """
+        async def analyze(data):
+            index, client, lock = next(rr)
+            await self._throttle_async(index, lock)
+            poller = await client.begin_analyze_document(
+                model_id="prebuilt-receipt",
+                body=data
+            )
+            return await poller.result()
         
-        # Get document fields
-        if result.documents:
-            for field_name, field in result.documents[0].fields.items():
-                if field_name == "MerchantName" and field.content:
-                    receipt_data["merchant"] = field.content
-                elif field_name == "TransactionDate" and field.content:
-                    receipt_data["date"] = field.content
-                elif field_name == "Subtotal" and field.content:
-                    receipt_data["subtotal"] = field.content
-                elif field_name == "TotalTax" and field.content:
-                    receipt_data["tax"] = field.content
-                elif field_name == "Total" and field.content:
-                    receipt_data["total"] = field.content
-                elif field_name == "Items":
-                    # Use value_array to get the items
-                    items_array = field.value_array
-                    if items_array:
-                        for item in items_array:
-                            item_dict = {}
-                            # item should be a DocumentField with properties
-                            if hasattr(item, 'value_object') and item.value_object:
-                                for key, val in item.value_object.items():
-                                    if hasattr(val, 'content'):
-                                        item_dict[key] = val.content
-                                    else:
-                                        item_dict[key] = str(val)
-                            receipt_data["items"].append(item_dict)
+        try:
+            async with sem:
+                data = await asyncio.to_thread(_read_bytes, path)
+                cache_path = await asyncio.to_thread(self._cache_path, data)
+                receipt_data = await asyncio.to_thread(self._load_cached, cache_path)
+                if receipt_data is None:
+                    result = await self._call_with_retry_async(analyze, data)
+                    receipt_data = _extract_receipt_data(result)
+                    await asyncio.to_thread(self._store_cached, cache_path, receipt_data)
+        except Exception as e:
+            print(f"Error processing {path}: {str(e)}")
+            return {"file": path, "error": str(e)}
         
+        receipt_data["file"] = path
         return receipt_data
     
-    def process_receipts_batch(self, image_paths):
-        """Process multiple receipts and return list of results"""
-        results = []
-        for path in image_paths:
-            try:
-                result = self.process_receipt(path)
-                result["file"] = path
-                results.append(result)
-            except Exception as e:
-                print(f"Error processing {path}: {str(e)}")
-                results.append({"file": path, "error": str(e)})
+    async def process_receipts_batch_async(self, image_paths, max_concurrency=8):
+        """
+        Process multiple receipts concurrently and return list of results.
+        At most max_concurrency Azure requests are in flight at once.
+        """
+        sem = asyncio.Semaphore(max_concurrency)
+        
+        async with AsyncExitStack() as stack:
+            rr = await self._open_async_clients(stack)
+            return await asyncio.gather(
+                *(self._process_receipt_async(rr, sem, path) for path in image_paths)
+            )
+    
+    async def iter_receipts_async(self, image_paths, max_concurrency=8):
+        """
+        Like process_receipts_batch_async, but yield each result as soon as it
+        finishes (completion order, not input order) so callers can start on
+        it while the rest are still in flight.
+        """
+        sem = asyncio.Semaphore(max_concurrency)
         
-        return results
+        async with AsyncExitStack() as stack:
+            rr = await self._open_async_clients(stack)
+            pending = [self._process_receipt_async(rr, sem, path) for path in image_paths]
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
     
     def save_to_json(self, receipt_data, output_path):
         """Save extracted data to JSON file"""
-        with open(output_path, 'w') as f:
-            json.dump(receipt_data, f, indent=2, default=str)
\ No newline at end of file
+        _dump_json(receipt_data, output_path, indent=True)
\ No newline at end of file
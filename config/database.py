@@ -22,6 +22,14 @@ class DatabaseConfig:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WAL is persistent on the database file; NORMAL is durable enough under WAL
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        
+        # sqlite3 runs DDL in autocommit mode, so open one explicit transaction
+        # to commit both tables together
+        cursor.execute("BEGIN")
+        
         # Create receipts table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS receipts (
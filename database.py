@@ -1,22 +1,69 @@
 import psycopg2
 from psycopg2.extras import execute_values
-from datetime import datetime
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+from datetime import date, datetime
 import re
 
+# Compiled once at import rather than looked up in re's cache on every call
+_NUM_RE = re.compile(r'[\d.]+')
+_ISO_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_DASHED_DATE_RE = re.compile(r'^(\d{1,2})-(\d{1,2})-(\d{4}|\d{2})$')
+_DATE_FORMATS = ('%m-%d-%Y', '%m-%d-%y', '%Y-%m-%d', '%d-%m-%Y')
+
+
+def _first_number(value):
+    """Float value of the first run of digits/dots in value, or None"""
+    text = str(value)
+    # Fast path: already a plain number like "1.29" or "3", so skip the regex
+    # and its Match object (isascii guards against non-ASCII digits)
+    if text.isascii() and text.replace('.', '', 1).isdigit():
+        return float(text)
+    
+    match = _NUM_RE.search(text)
+    if match:
+        return float(match.group())
+    return None
+
+
+def _parse_dashed_date(first, second, year):
+    """
+    Build a date from MM-DD-YYYY, MM-DD-YY or DD-MM-YYYY parts, tried in the
+    same order as _DATE_FORMATS. Returns None if no reading is a valid date.
+    """
+    year_num = int(year)
+    if len(year) == 2:
+        # Same pivot as strptime's %y: 69-99 -> 1900s, 00-68 -> 2000s
+        year_num += 1900 if year_num >= 69 else 2000
+        orders = ((first, second),)
+    else:
+        orders = ((first, second), (second, first))
+    
+    for month, day in orders:
+        try:
+            return date(year_num, int(month), int(day))
+        except ValueError:
+            continue
+    return None
+
+
 class ReceiptDatabase:
-    def __init__(self, dbname, user, password, host='localhost', port=5432):
-        """Initialize database connection"""
+    def __init__(self, dbname, user, password, host='localhost', port=5432, max_concurrency=8):
+        """Initialize database settings; the connection pool is created on connect()"""
         self.dbname = dbname
         self.user = user
         self.password = password
         self.host = host
         self.port = port
-        self.conn = None
+        self.max_concurrency = max_concurrency
+        self.pool = None
     
     def connect(self):
-        """Establish database connection"""
+        """Create the connection pool, sized for max_concurrency parallel inserts"""
         try:
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                minconn=2,
+                maxconn=self.max_concurrency + 2,
                 dbname=self.dbname,
                 user=self.user,
                 password=self.password,
@@ -27,13 +74,62 @@ class ReceiptDatabase:
         except psycopg2.Error as e:
             print(f"✗ Failed to connect: {e}")
             raise
+        
+        try:
+            self._ensure_schema()
+        except psycopg2.Error:
+            self.close()
+            raise
+    
+    def _ensure_schema(self):
+        """
+        Create the unique lookup indexes the merchant/product upserts depend on.
+        They also turn name lookups into index scans and prevent duplicates.
+        Raises if they cannot be created, since every upsert would fail without them.
+        """
+        try:
+            with self._conn() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS merchant_name_uidx ON merchant (merchant_name)"
+                    )
+                    cur.execute(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS product_description_uidx ON product (product_description)"
+                    )
+                finally:
+                    cur.close()
+        except psycopg2.Error as e:
+            # e.g. existing duplicate rows; fail before any receipts are sent to OCR
+            print(f"✗ Could not create lookup indexes: {e}")
+            raise
     
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        """Close all pooled connections"""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
             print("✓ Connection closed")
     
+    @contextmanager
+    def _conn(self):
+        """
+        Borrow a pooled connection for one transaction: commit on success,
+        roll back on error, always return it to the pool.
+        """
+        if self.pool is None:
+            self.connect()
+        
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+    
     def parse_date(self, date_str):
         """
         Convert date string to YYYY-MM-DD format
@@ -43,10 +139,26 @@ class ReceiptDatabase:
             return None
         
         try:
+            date_str = date_str.strip()
+            
+            # Fast path: already YYYY-MM-DD, validated without strptime
+            if _ISO_RE.match(date_str):
+                return date.fromisoformat(date_str).strftime('%Y-%m-%d')
+            
+            # Receipts almost always print MM-DD-YYYY; build it from the digits
+            # directly instead of walking format strings with strptime
+            match = _DASHED_DATE_RE.match(date_str)
+            if match:
+                date_obj = _parse_dashed_date(*match.groups())
+                if date_obj:
+                    return date_obj.strftime('%Y-%m-%d')
+                print(f"⚠ Could not parse date: {date_str}")
+                return None
+            
             # Try common formats
-            for fmt in ['%m-%d-%Y', '%m-%d-%y', '%Y-%m-%d', '%d-%m-%Y']:
+            for fmt in _DATE_FORMATS:
                 try:
-                    date_obj = datetime.strptime(date_str.strip(), fmt)
+                    date_obj = datetime.strptime(date_str, fmt)
                     return date_obj.strftime('%Y-%m-%d')
                 except ValueError:
                     continue
@@ -67,10 +179,7 @@ class ReceiptDatabase:
         
         try:
             # Remove units like 'EA', 'lb', etc and extract number
-            match = re.search(r'[\d.]+', str(quantity_str))
-            if match:
-                return float(match.group())
-            return None
+            return _first_number(quantity_str)
         except Exception as e:
             print(f"⚠ Quantity parsing error: {e}")
             return None
@@ -85,80 +194,153 @@ class ReceiptDatabase:
         
         try:
             # Remove currency symbols and units, extract number
-            match = re.search(r'[\d.]+', str(price_str))
-            if match:
-                return float(match.group())
-            return None
+            return _first_number(price_str)
         except Exception as e:
             print(f"⚠ Price parsing error: {e}")
             return None
     
-    def insert_or_get_merchant(self, merchant_name, address=None, phone=None):
+    def insert_or_get_merchant(self, cur, merchant_name, address=None, phone=None):
         """
         Insert merchant if not exists, return merchant_id
+        
+        Single upsert round-trip; relies on the unique index on merchant_name
+        created by _ensure_schema. Database errors propagate so the caller can
+        roll back its transaction.
         """
         if not merchant_name:
             return None
         
-        cur = self.conn.cursor()
-        try:
-            # Try to get existing merchant
-            cur.execute(
-                "SELECT merchant_id FROM merchant WHERE merchant_name = %s",
-                (merchant_name,)
-            )
-            result = cur.fetchone()
-            
-            if result:
-                return result[0]
-            
-            # Insert new merchant
-            cur.execute(
-                """INSERT INTO merchant (merchant_name, address, phone_number)
-                   VALUES (%s, %s, %s) RETURNING merchant_id""",
-                (merchant_name, address, phone)
-            )
-            merchant_id = cur.fetchone()[0]
+        # The no-op DO UPDATE makes RETURNING yield the id of an existing row too;
+        # xmax = 0 only for freshly inserted rows
+        cur.execute(
+            """INSERT INTO merchant (merchant_name, address, phone_number)
+               VALUES (%s, %s, %s)
+               ON CONFLICT (merchant_name) DO UPDATE SET merchant_name = EXCLUDED.merchant_name
+               RETURNING merchant_id, (xmax = 0) AS inserted""",
+            (merchant_name, address, phone)
+        )
+        merchant_id, inserted = cur.fetchone()
+        if inserted:
             print(f"  ✓ Created merchant: {merchant_name}")
-            return merchant_id
-        except psycopg2.Error as e:
-            print(f"  ✗ Error inserting merchant: {e}")
-            return None
-        finally:
-            cur.close()
+        return merchant_id
+    
+    def insert_or_get_merchants(self, cur, merchant_names):
+        """
+        Upsert many merchants in one round-trip, return {merchant_name: merchant_id}
+        Database errors propagate so the caller can roll back its transaction.
+        """
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement,
+        # and sorting makes concurrent transactions take row locks in the same
+        # order so they can't deadlock
+        distinct = sorted(set(m for m in merchant_names if m))
+        if not distinct:
+            return {}
+        
+        rows = execute_values(
+            cur,
+            """INSERT INTO merchant (merchant_name) VALUES %s
+               ON CONFLICT (merchant_name) DO UPDATE SET merchant_name = EXCLUDED.merchant_name
+               RETURNING merchant_name, merchant_id""",
+            [(m,) for m in distinct],
+            page_size=len(distinct),
+            fetch=True
+        )
+        return dict(rows)
     
-    def insert_or_get_product(self, product_description, category=None):
+    def insert_or_get_product(self, cur, product_description, category=None):
         """
         Insert product if not exists, return product_id
+        
+        Single upsert round-trip; relies on the unique index on product_description
+        created by _ensure_schema. Database errors propagate so the caller can
+        roll back its transaction.
         """
         if not product_description:
             return None
         
-        cur = self.conn.cursor()
-        try:
-            # Try to get existing product
-            cur.execute(
-                "SELECT product_id FROM product WHERE product_description = %s",
-                (product_description,)
-            )
-            result = cur.fetchone()
+        cur.execute(
+            """INSERT INTO product (product_description, category)
+               VALUES (%s, %s)
+               ON CONFLICT (product_description) DO UPDATE SET product_description = EXCLUDED.product_description
+               RETURNING product_id""",
+            (product_description, category)
+        )
+        return cur.fetchone()[0]
+    
+    def insert_or_get_products(self, cur, product_descriptions):
+        """
+        Upsert many products in one round-trip, return {product_description: product_id}
+        Database errors propagate so the caller can roll back its transaction.
+        """
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement,
+        # and sorting makes concurrent transactions take row locks in the same
+        # order so they can't deadlock
+        distinct = sorted(set(d for d in product_descriptions if d))
+        if not distinct:
+            return {}
+        
+        rows = execute_values(
+            cur,
+            """INSERT INTO product (product_description) VALUES %s
+               ON CONFLICT (product_description) DO UPDATE SET product_description = EXCLUDED.product_description
+               RETURNING product_description, product_id""",
+            [(d,) for d in distinct],
+            page_size=len(distinct),
+            fetch=True
+        )
+        return dict(rows)
+    
+    def _parse_receipt(self, receipt_data):
+        """
+        Parse and validate a receipt dict (see insert_receipt for the format).
+        Returns (merchant_name, transaction_date, subtotal, tax, total, items)
+        where items are (description, quantity, unit_price, total_price) tuples,
+        or None if a required field is missing.
+        """
+        # Parse and validate required fields
+        merchant_name = receipt_data.get('merchant')
+        transaction_date = self.parse_date(receipt_data.get('date'))
+        subtotal = self.parse_price(receipt_data.get('subtotal'))
+        tax = self.parse_price(receipt_data.get('tax'))
+        total = self.parse_price(receipt_data.get('total'))
+        
+        if not merchant_name:
+            print("✗ Receipt missing merchant name")
+            return None
+        
+        if not transaction_date:
+            print("✗ Receipt missing valid date")
+            return None
+        
+        if not total:
+            print("✗ Receipt missing total")
+            return None
+        
+        parsed_items = []
+        for item in receipt_data.get('items') or []:
+            description = item.get('Description')
+            if not description:
+                continue
             
-            if result:
-                return result[0]
+            # Parse item data
+            quantity = self.parse_quantity(item.get('Quantity'))
+            unit_price = self.parse_price(item.get('Price'))
+            total_price = self.parse_price(item.get('TotalPrice'))
             
-            # Insert new product
-            cur.execute(
-                """INSERT INTO product (product_description, category)
-                   VALUES (%s, %s) RETURNING product_id""",
-                (product_description, category)
-            )
-            product_id = cur.fetchone()[0]
-            return product_id
-        except psycopg2.Error as e:
-            print(f"  ✗ Error inserting product: {e}")
-            return None
-        finally:
-            cur.close()
+            if not total_price:
+                continue
+            
+            # If unit_price not available, calculate from total
+            if not unit_price and quantity:
+                unit_price = total_price / quantity
+            
+            # If quantity not available, assume 1
+            if not quantity:
+                quantity = 1
+            
+            parsed_items.append((description, quantity, unit_price, total_price))
+        
+        return merchant_name, transaction_date, subtotal, tax, total, parsed_items
     
     def insert_receipt(self, receipt_data):
         """
@@ -177,127 +359,184 @@ class ReceiptDatabase:
             'total': '$38.68'
         }
         """
-        cur = self.conn.cursor()
-        
-        try:
-            # Parse and validate required fields
-            merchant_name = receipt_data.get('merchant')
-            transaction_date = self.parse_date(receipt_data.get('date'))
-            subtotal = self.parse_price(receipt_data.get('subtotal'))
-            tax = self.parse_price(receipt_data.get('tax'))
-            total = self.parse_price(receipt_data.get('total'))
-            items = receipt_data.get('items', [])
-            
-            if not merchant_name:
-                print("✗ Receipt missing merchant name")
-                return False
+        with self._conn() as conn:
+            cur = conn.cursor()
             
-            if not transaction_date:
-                print("✗ Receipt missing valid date")
-                return False
+            try:
+                parsed = self._parse_receipt(receipt_data)
+                if parsed is None:
+                    return False
+                merchant_name, transaction_date, subtotal, tax, total, parsed_items = parsed
+                
+                # Upsert merchant and insert receipt header in one round-trip
+                cur.execute(
+                    """WITH m AS (
+                           INSERT INTO merchant (merchant_name) VALUES (%s)
+                           ON CONFLICT (merchant_name) DO UPDATE SET merchant_name = EXCLUDED.merchant_name
+                           RETURNING merchant_id
+                       )
+                       INSERT INTO receipt (merchant_id, transaction_date, subtotal, tax, total)
+                       VALUES ((SELECT merchant_id FROM m), %s, %s, %s, %s) RETURNING receipt_id""",
+                    (merchant_name, transaction_date, subtotal, tax, total)
+                )
+                receipt_id = cur.fetchone()[0]
+                print(f"✓ Created receipt #{receipt_id} from {merchant_name} on {transaction_date}")
+                
+                # Insert receipt items
+                if not receipt_data.get('items'):
+                    print("  ⚠ Receipt has no items")
+                    return True
+                
+                # Get or create all products in one round-trip
+                product_ids = self.insert_or_get_products(
+                    cur, (d for d, _, _, _ in parsed_items)
+                )
+                
+                rows = []
+                for description, quantity, unit_price, total_price in parsed_items:
+                    product_id = product_ids.get(description)
+                    if not product_id:
+                        print(f"  ⚠ Failed to insert product: {description}")
+                        continue
+                    
+                    rows.append((receipt_id, product_id, quantity, unit_price, total_price))
+                
+                # Insert all receipt items in a single round-trip
+                if rows:
+                    execute_values(
+                        cur,
+                        """INSERT INTO receipt_item (receipt_id, product_id, quantity, unit_price, total_price)
+                           VALUES %s""",
+                        rows,
+                        page_size=200
+                    )
+                
+                print(f"  ✓ Inserted {len(rows)} items")
+                return True
             
-            if not total:
-                print("✗ Receipt missing total")
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"✗ Database error: {e}")
                 return False
-            
-            # Insert merchant (or get existing)
-            merchant_id = self.insert_or_get_merchant(merchant_name)
-            if not merchant_id:
-                print("✗ Failed to get/create merchant")
+            except Exception as e:
+                conn.rollback()
+                print(f"✗ Unexpected error: {e}")
                 return False
+            finally:
+                cur.close()
+    
+    def insert_receipts_bulk(self, receipts):
+        """
+        Insert many receipts in a single transaction using four round-trips in
+        total: merchants, products, receipt headers, receipt items.
+        Receipts that fail validation are skipped; any database error rolls
+        back the whole batch.
+        Returns one status per receipt: True if it was inserted, None if it
+        failed validation, False if it was rolled back by a database error.
+        """
+        parsed_all = [self._parse_receipt(r) for r in receipts]
+        parsed = [p for p in parsed_all if p is not None]
+        rolled_back = [None if p is None else False for p in parsed_all]
+        if not parsed:
+            return rolled_back
+        
+        with self._conn() as conn:
+            cur = conn.cursor()
             
-            # Insert receipt header
-            cur.execute(
-                """INSERT INTO receipt (merchant_id, transaction_date, subtotal, tax, total)
-                   VALUES (%s, %s, %s, %s, %s) RETURNING receipt_id""",
-                (merchant_id, transaction_date, subtotal, tax, total)
-            )
-            receipt_id = cur.fetchone()[0]
-            print(f"✓ Created receipt #{receipt_id} from {merchant_name} on {transaction_date}")
-            
-            # Insert receipt items
-            if not items:
-                print("  ⚠ Receipt has no items")
-                self.conn.commit()
-                return True
-            
-            for item in items:
-                description = item.get('Description')
-                if not description:
-                    continue
-                
-                # Parse item data
-                quantity = self.parse_quantity(item.get('Quantity'))
-                unit_price = self.parse_price(item.get('Price'))
-                total_price = self.parse_price(item.get('TotalPrice'))
+            try:
+                merchant_ids = self.insert_or_get_merchants(cur, (p[0] for p in parsed))
+                if not all(p[0] in merchant_ids for p in parsed):
+                    conn.rollback()
+                    print("✗ Failed to get/create merchants")
+                    return rolled_back
                 
-                if not total_price:
-                    continue
+                product_ids = self.insert_or_get_products(
+                    cur, (d for p in parsed for d, _, _, _ in p[5])
+                )
                 
-                # If unit_price not available, calculate from total
-                if not unit_price and quantity:
-                    unit_price = total_price / quantity
+                # RETURNING order is not guaranteed, so insert in ord order (serial ids
+                # are assigned in that order) and sort the returned ids to map them back.
+                # Casts are needed because a VALUES subquery doesn't infer column types.
+                receipt_ids = execute_values(
+                    cur,
+                    """INSERT INTO receipt (merchant_id, transaction_date, subtotal, tax, total)
+                       SELECT merchant_id, transaction_date, subtotal, tax, total
+                       FROM (VALUES %s) AS v(ord, merchant_id, transaction_date, subtotal, tax, total)
+                       ORDER BY ord
+                       RETURNING receipt_id""",
+                    [
+                        (ord, merchant_ids[m], d, sub, tax, tot)
+                        for ord, (m, d, sub, tax, tot, _) in enumerate(parsed)
+                    ],
+                    template="(%s, %s, %s::date, %s::numeric, %s::numeric, %s::numeric)",
+                    page_size=len(parsed),
+                    fetch=True
+                )
+                receipt_ids = sorted(receipt_id for receipt_id, in receipt_ids)
                 
-                # If quantity not available, assume 1
-                if not quantity:
-                    quantity = 1
+                rows = []
+                for receipt_id, (*_, parsed_items) in zip(receipt_ids, parsed):
+                    for description, quantity, unit_price, total_price in parsed_items:
+                        product_id = product_ids.get(description)
+                        if not product_id:
+                            print(f"  ⚠ Failed to insert product: {description}")
+                            continue
+                        
+                        rows.append((receipt_id, product_id, quantity, unit_price, total_price))
                 
-                # Get or create product
-                product_id = self.insert_or_get_product(description)
-                if not product_id:
-                    print(f"  ⚠ Failed to insert product: {description}")
-                    continue
+                if rows:
+                    execute_values(
+                        cur,
+                        """INSERT INTO receipt_item (receipt_id, product_id, quantity, unit_price, total_price)
+                           VALUES %s""",
+                        rows,
+                        page_size=len(rows)
+                    )
                 
-                # Insert receipt item
-                cur.execute(
-                    """INSERT INTO receipt_item (receipt_id, product_id, quantity, unit_price, total_price)
-                       VALUES (%s, %s, %s, %s, %s)""",
-                    (receipt_id, product_id, quantity, unit_price, total_price)
-                )
+                print(f"✓ Inserted {len(parsed)} receipts with {len(rows)} items")
+                return [None if p is None else True for p in parsed_all]
             
-            self.conn.commit()
-            print(f"  ✓ Inserted {len(items)} items")
-            return True
-        
-        except psycopg2.Error as e:
-            self.conn.rollback()
-            print(f"✗ Database error: {e}")
-            return False
-        except Exception as e:
-            self.conn.rollback()
-            print(f"✗ Unexpected error: {e}")
-            return False
-        finally:
-            cur.close()
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"✗ Database error: {e}")
+                return rolled_back
+            except Exception as e:
+                conn.rollback()
+                print(f"✗ Unexpected error: {e}")
+                return rolled_back
+            finally:
+                cur.close()
     
     def get_merchant_summary(self):
         """Get summary of merchants and spending"""
-        cur = self.conn.cursor()
-        try:
-            cur.execute(
-                """SELECT m.merchant_name, COUNT(r.receipt_id) as num_receipts, SUM(r.total) as total_spent
-                   FROM receipt r
-                   JOIN merchant m ON r.merchant_id = m.merchant_id
-                   GROUP BY m.merchant_name
-                   ORDER BY total_spent DESC"""
-            )
-            return cur.fetchall()
-        finally:
-            cur.close()
+        with self._conn() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """SELECT m.merchant_name, COUNT(r.receipt_id) as num_receipts, SUM(r.total) as total_spent
+                       FROM receipt r
+                       JOIN merchant m ON r.merchant_id = m.merchant_id
+                       GROUP BY m.merchant_name
+                       ORDER BY total_spent DESC"""
+                )
+                return cur.fetchall()
+            finally:
+                cur.close()
     
     def get_product_summary(self):
         """Get summary of most purchased products"""
-        cur = self.conn.cursor()
-        try:
-            cur.execute(
-                """SELECT p.product_description, COUNT(ri.receipt_item_id) as purchases, 
-                          SUM(ri.total_price) as total_spent
-                   FROM receipt_item ri
-                   JOIN product p ON ri.product_id = p.product_id
-                   GROUP BY p.product_description
-                   ORDER BY purchases DESC
-                   LIMIT 20"""
-            )
-            return cur.fetchall()
-        finally:
-            cur.close()
\ No newline at end of file
+        with self._conn() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """SELECT p.product_description, COUNT(ri.receipt_item_id) as purchases, 
+                              SUM(ri.total_price) as total_spent
+                       FROM receipt_item ri
+                       JOIN product p ON ri.product_id = p.product_id
+                       GROUP BY p.product_description
+                       ORDER BY purchases DESC
+                       LIMIT 20"""
+                )
+                return cur.fetchall()
+            finally:
+                cur.close()
\ No newline at end of file
@@ -22,29 +22,23 @@ if result.documents:
     for field_name, field in doc.fields.items():
         print(f"\n{field_name}:")
         print(f"  Type: {type(field).__name__}")
-        print(f"  Content: {field.content if hasattr(field, 'content') else 'N/A'}")
+        print(f"  Content: {getattr(field, 'content', 'N/A')}")
         
-        # If it's Items, print structure
-        if field_name == "Items":
-            print(f"  Has value_array: {hasattr(field, 'value_array')}")
+        # Only Items has nested structure worth walking
+        if field_name != "Items":
+            continue
+        
+        items_array = getattr(field, 'value_array', None)
+        print(f"  Has value_array: {items_array is not None}")
+        print(f"  Items found: {len(items_array) if items_array else 0}")
+        
+        for idx, item in enumerate(items_array or []):
+            value_object = getattr(item, 'value_object', None)
+            print(f"\n  Item {idx}:")
+            print(f"    Type: {type(item).__name__}")
+            print(f"    Has value_object: {value_object is not None}")
             
-            # Try to get items using value_array
-            try:
-                items_array = field.value_array
-                print(f"  Items found: {len(items_array) if items_array else 0}")
-                
-                if items_array:
-                    for idx, item in enumerate(items_array):
-                        print(f"\n  Item {idx}:")
-                        print(f"    Type: {type(item).__name__}")
-                        print(f"    Has value_object: {hasattr(item, 'value_object')}")
-                        
-                        if hasattr(item, 'value_object') and item.value_object:
-                            print(f"    Properties:")
-                            for key, val in item.value_object.items():
-                                val_content = val.content if hasattr(val, 'content') else str(val)
-                                print(f"      {key}: {val_content}")
-            except Exception as e:
-                print(f"  Error: {e}")
-                import traceback
-                traceback.print_exc()
\ No newline at end of file
+            if value_object:
+                print(f"    Properties:")
+                for key, val in value_object.items():
+                    print(f"      {key}: {getattr(val, 'content', None) or str(val)}")
\ No newline at end of file
@@ -1,17 +1,38 @@
-import cv2
+from PIL import Image, ImageDraw
 
 def draw_boxes_from_entities(image_path, entities, output='boxed.jpg'):
-    img = cv2.imread(image_path)
-    
+    # RGB (PIL) equivalents of the BGR colors previously used with OpenCV
     colors = {
         'supplier_name': (0, 255, 0),
-        'line_item': (0, 165, 255),
-        'total': (255, 192, 203)
+        'line_item': (255, 165, 0),
+        'total': (203, 192, 255)
     }
     
-    for entity in entities:
-        if entity.type_ in colors:
-            # Draw box logic here
-            pass
+    # Opening is lazy: only the header is read until we actually draw.
+    # The with block closes the file even when nothing is drawn.
+    with Image.open(image_path) as img:
+        width, height = img.size
+        
+        boxed = None
+        draw = None
+        for entity in entities:
+            if entity.type_ in colors:
+                for page_ref in entity.page_anchor.page_refs:
+                    vertices = page_ref.bounding_poly.normalized_vertices
+                    if not vertices:
+                        continue
+                    
+                    xs = [v.x * width for v in vertices]
+                    ys = [v.y * height for v in vertices]
+                    if draw is None:
+                        boxed = img.convert('RGB')
+                        draw = ImageDraw.Draw(boxed)
+                    draw.rectangle(
+                        [min(xs), min(ys), max(xs), max(ys)],
+                        outline=colors[entity.type_],
+                        width=2
+                    )
     
-    cv2.imwrite(output, img)
\ No newline at end of file
+    # Nothing drawn: skip decoding and re-encoding the JPEG entirely
+    if boxed is not None:
+        boxed.save(output, quality=92, optimize=True)
@@ -1,76 +1,157 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
 from dotenv import load_dotenv
+import asyncio
 import os
 from azure_ocr import AzureReceiptParser
 from database import ReceiptDatabase
 import json
 
-load_dotenv()
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Settings read from the environment / .env"""
+    api_key: str | None
+    endpoint: str | None
+    db_name: str
+    db_user: str
+    db_password: str | None
+    db_host: str
+    db_port: int
+    
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        return cls(
+            api_key=os.getenv('AZURE_DOCUMENT_INTELLIGENCE_KEY'),
+            endpoint=os.getenv('AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT'),
+            db_name=os.getenv('DB_NAME', 'receipt_inventory'),
+            db_user=os.getenv('DB_USER', 'postgres'),
+            db_password=os.getenv('DB_PASSWORD'),
+            db_host=os.getenv('DB_HOST', 'localhost'),
+            db_port=int(os.getenv('DB_PORT', 5432))
+        )
+
+
+@lru_cache(maxsize=None)
+def load_config():
+    """Read .env and the environment once per process"""
+    return Config.from_env()
+
+
+@lru_cache(maxsize=None)
+def get_parser(config):
+    """Reuse one parser (and its Azure client) per config"""
+    return AzureReceiptParser(api_key=config.api_key, endpoint=config.endpoint)
+
+
+@lru_cache(maxsize=None)
+def get_database(config):
+    """Reuse one ReceiptDatabase per config"""
+    return ReceiptDatabase(
+        dbname=config.db_name,
+        user=config.db_user,
+        password=config.db_password,
+        host=config.db_host,
+        port=config.db_port
+    )
+
+
+async def run_pipeline(parser, db, receipt_paths, batch_size=16):
+    """
+    OCR receipts concurrently and insert them into the database as they finish.
+    OCR results go through a bounded queue to a single DB consumer that inserts
+    up to batch_size receipts at a time, so inserts overlap with pending OCR calls.
+    """
+    queue = asyncio.Queue(maxsize=32)
+    
+    async def produce():
+        try:
+            async for receipt_data in parser.iter_receipts_async(receipt_paths):
+                receipt_path = receipt_data.pop("file")
+                if "error" in receipt_data:
+                    print(f"  ✗ Failed to parse: {receipt_path}")
+                    continue
+                
+                # Save to JSON for inspection
+                json_output = receipt_path.with_name(receipt_path.stem + '_output.json')
+                await asyncio.to_thread(parser.save_to_json, receipt_data, json_output)
+                print(f"  ✓ Saved JSON: {json_output}")
+                
+                await queue.put((receipt_path, receipt_data))
+        finally:
+            # Sentinel: no more receipts
+            await queue.put(None)
+    
+    async def consume():
+        done = False
+        while not done:
+            batch = [await queue.get()]
+            try:
+                while len(batch) < batch_size:
+                    batch.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                pass
+            
+            # The sentinel is always the last item queued
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            
+            if batch:
+                await insert_batch(batch)
+    
+    async def insert_batch(batch):
+        receipts = [receipt_data for _, receipt_data in batch]
+        try:
+            inserted = await asyncio.to_thread(db.insert_receipts_bulk, receipts)
+        except Exception as e:
+            print(f"  ✗ Bulk insert failed: {e}")
+            inserted = [False] * len(batch)
+        
+        # One bad receipt rolls back the whole bulk transaction, so retry the
+        # receipts rolled back (False) one at a time to isolate the failure.
+        # Receipts that failed validation (None) would only fail again.
+        failed = []
+        for (receipt_path, receipt_data), ok in zip(batch, inserted):
+            if ok is False:
+                ok = await asyncio.to_thread(db.insert_receipt, receipt_data)
+            if not ok:
+                failed.append(receipt_path)
+        
+        print(f"  ✓ Inserted {len(batch) - len(failed)}/{len(batch)} receipts to database")
+        for receipt_path in failed:
+            print(f"  ✗ Failed to insert to database: {receipt_path}")
+    
+    await asyncio.gather(produce(), consume())
+
 
 def main():
-    # Get Azure credentials
-    api_key = os.getenv('AZURE_DOCUMENT_INTELLIGENCE_KEY')
-    endpoint = os.getenv('AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT')
+    config = load_config()
     
-    if not api_key or not endpoint:
+    if not config.api_key or not config.endpoint:
         print("ERROR: Missing Azure credentials in .env")
         return
     
-    # Get database credentials
-    db_name = os.getenv('DB_NAME', 'receipt_inventory')
-    db_user = os.getenv('DB_USER', 'postgres')
-    db_password = os.getenv('DB_PASSWORD')
-    db_host = os.getenv('DB_HOST', 'localhost')
-    db_port = int(os.getenv('DB_PORT', 5432))
-    
-    if not db_password:
+    if not config.db_password:
         print("ERROR: Missing DB_PASSWORD in .env")
         return
     
     # Initialize parser and database
-    parser = AzureReceiptParser(api_key=api_key, endpoint=endpoint)
-    db = ReceiptDatabase(
-        dbname=db_name,
-        user=db_user,
-        password=db_password,
-        host=db_host,
-        port=db_port
-    )
+    parser = get_parser(config)
+    db = get_database(config)
     
     # Connect to database
     db.connect()
     
     try:
-        # Process receipts
-        receipt_paths = [
-            'data/receipts/0.jpg',
-            'data/receipts/1.jpg',
-            # Add more receipt paths as needed
-        ]
+        # Process every .jpg/.jpeg (any case) in the receipts folder
+        receipt_paths = sorted(Path('data/receipts').glob('*.[jJ][pP]*[gG]'))
         
         print("\n=== PROCESSING RECEIPTS ===\n")
         
-        for receipt_path in receipt_paths:
-            if not os.path.exists(receipt_path):
-                print(f"⚠ File not found: {receipt_path}")
-                continue
-            
-            print(f"Processing: {receipt_path}")
-            
-            # Parse receipt
-            receipt_data = parser.process_receipt(receipt_path)
-            
-            # Save to JSON for inspection
-            json_output = receipt_path.replace('.jpg', '_output.json')
-            parser.save_to_json(receipt_data, json_output)
-            print(f"  ✓ Saved JSON: {json_output}")
-            
-            # Insert into database
-            if db.insert_receipt(receipt_data):
-                print(f"  ✓ Successfully inserted to database")
-            else:
-                print(f"  ✗ Failed to insert to database")
-            
-            print()
+        asyncio.run(run_pipeline(parser, db, receipt_paths))
         
         # Print summaries
         print("\n=== MERCHANT SUMMARY ===\n")